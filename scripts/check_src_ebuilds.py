@@ -5,9 +5,12 @@
 
 import argparse
 import difflib
+import mmap
 import os
 import subprocess
 import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 
 from shared import (
     BRAVE_TO_CHROME_CHANNELS,
@@ -18,6 +21,28 @@ from shared import (
     require_gha,
 )
 
+try:
+    from cdifflib import CSequenceMatcher
+
+    # unified_diff() looks up SequenceMatcher in the difflib module
+    difflib.SequenceMatcher = CSequenceMatcher
+except ImportError:
+    pass
+
+
+def _same_contents(path1, path2):
+    size = os.path.getsize(path1)
+    if size != os.path.getsize(path2):
+        return False
+    if size <= 4096:
+        return Path(path1).read_bytes() == Path(path2).read_bytes()
+
+    with open(path1, "rb") as f1, open(path2, "rb") as f2:
+        with mmap.mmap(f1.fileno(), 0, access=mmap.ACCESS_READ) as mm1, mmap.mmap(
+            f2.fileno(), 0, access=mmap.ACCESS_READ
+        ) as mm2:
+            return memoryview(mm1) == memoryview(mm2)
+
 
 def check_for_divergence(repo_dir=None, use_local_repo=True):
     repo_dir = repo_dir or os.getcwd()
@@ -44,8 +69,7 @@ def check_for_divergence(repo_dir=None, use_local_repo=True):
             check=True,
         )
 
-    results = {}
-    for channel in CHANNELS:
+    def _check(channel):
         src_ebuild = get_ebuilds(
             BRAVE_TO_CHROME_CHANNELS[channel],
             repo_dir=src_dir,
@@ -58,6 +82,10 @@ def check_for_divergence(repo_dir=None, use_local_repo=True):
             base_name="google-chrome",
             only_latest=True,
         )[0][0]
+
+        if _same_contents(src_ebuild, gentoo_ebuild):
+            return channel, None
+
         src_ebuild_rel = os.path.relpath(src_ebuild, src_dir)
         gentoo_ebuild_rel = os.path.relpath(gentoo_ebuild, gentoo_dir)
         result = {
@@ -66,18 +94,25 @@ def check_for_divergence(repo_dir=None, use_local_repo=True):
             "gentoo_ebuild": gentoo_ebuild_rel,
         }
 
-        with open(src_ebuild, "r") as f1, open(gentoo_ebuild, "r") as f2:
-            s1 = f1.read().splitlines()
-            s2 = f2.read().splitlines()
-            if s1 != s2:
-                diff = difflib.unified_diff(
-                    s1,
-                    s2,
-                    fromfile=src_ebuild_rel,
-                    tofile=gentoo_ebuild_rel,
-                    lineterm="",
-                )
-                result["diff"] = list(diff)
+        s1 = Path(src_ebuild).read_text().splitlines()
+        s2 = Path(gentoo_ebuild).read_text().splitlines()
+        if s1 == s2:
+            return channel, None
+
+        diff = difflib.unified_diff(
+            s1,
+            s2,
+            fromfile=src_ebuild_rel,
+            tofile=gentoo_ebuild_rel,
+            lineterm="",
+        )
+        result["diff"] = list(diff)
+        return channel, result
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=len(CHANNELS)) as executor:
+        for channel, result in executor.map(_check, CHANNELS):
+            if result:
                 results[channel] = result
     return results
 
@@ -89,17 +124,18 @@ def write_step_summary(title, results=None):
     if not summary_file:
         raise RuntimeError("GITHUB_STEP_SUMMARY environment variable unset or empty.")
 
+    lines = [f"### {title}\n\n"]
+    if results:
+        for channel in CHANNELS:  # Iterate results in channel order
+            if channel not in results:
+                continue
+            lines.append(f"- **{channel.capitalize()}** ebuild has diverged:\n\n")
+            lines.append("    ```diff\n")
+            lines.extend(f"    {line}\n" for line in results[channel]["diff"])
+            lines.append("    ```\n\n")
+
     with open(summary_file, "a") as f:
-        f.write(f"### {title}\n\n")
-        if results:
-            for channel in CHANNELS:  # Iterate results in channel order
-                if channel not in results:
-                    continue
-                f.write(f"- **{channel.capitalize()}** ebuild has diverged:\n\n")
-                f.write("    ```diff\n")
-                for line in results[channel]["diff"]:
-                    f.write(f"    {line}\n")
-                f.write("    ```\n\n")
+        f.write("".join(lines))
 
 
 def main():
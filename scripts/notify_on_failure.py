@@ -4,6 +4,7 @@
 # SPDX-License-Identifier: MIT
 
 import argparse
+import atexit
 import json
 import os
 import smtplib
@@ -11,6 +12,36 @@ from email.mime.text import MIMEText
 
 from shared import get_run_id, get_run_jobs, require_gha
 
+_smtp = None
+
+
+def _get_smtp(email, password):
+    global _smtp
+    if _smtp is not None:
+        try:
+            if _smtp.noop()[0] == 250:
+                return _smtp
+        except smtplib.SMTPServerDisconnected:
+            pass
+
+    _smtp = smtplib.SMTP("smtp.gmail.com", 587)
+    _smtp.ehlo()
+    _smtp.starttls()
+    _smtp.ehlo()
+    _smtp.login(email, password)
+    return _smtp
+
+
+def _close_smtp():
+    if _smtp is not None:
+        try:
+            _smtp.quit()
+        except smtplib.SMTPServerDisconnected:
+            pass
+
+
+atexit.register(_close_smtp)
+
 
 def send_email(subject, body):
     email = os.environ.get("NOTIFICATION_EMAIL")
@@ -26,10 +57,8 @@ def send_email(subject, body):
     msg["From"] = email
     msg["To"] = email
 
-    with smtplib.SMTP("smtp.gmail.com", 587) as server:
-        server.starttls()
-        server.login(email, password)
-        server.send_message(msg)
+    server = _get_smtp(email, password)
+    server.sendmail(email, [email], msg.as_string())
 
 
 def main():
@@ -2,13 +2,27 @@
 #
 # SPDX-License-Identifier: MIT
 
-import glob
+import functools
 import json
 import os
 import re
 import subprocess
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import orjson
+
+    json_loads = orjson.loads
+
+    def json_dumps(obj):
+        return orjson.dumps(obj).decode()
+
+except ImportError:
+    json_loads = json.loads
+    json_dumps = json.dumps
 
 CHANNELS_WITH_TITLE = [
     ("stable", "Release "),
@@ -27,30 +41,49 @@ GH_API_ACTION_JOBS = "https://api.github.com/repos/{repo}/actions/runs/{run_id}/
 GENTOO_REPO = "/var/db/repos/gentoo"
 GENTOO_PORTAGE_MIRROR = "rsync://rsync.gentoo.org/gentoo-portage/"
 
-_JOB_NAME_RE = re.compile(r"^Test ebuild \((.+?)\) \[(.+?)\]$")
-_VERSION_REGEX = re.compile(r"-\d[\d\.-r]+")  # TODO
-
-
-def extract_version(path):
+_JOB_NAME_PREFIX = "Test ebuild ("
+_JOB_NAME_RE = re.compile(r"^Test ebuild \((.+?)\) \[(.+?)\]$", re.ASCII)
+
+SESSION = requests.Session()
+SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=16,
+        max_retries=Retry(
+            total=5, backoff_factor=0.5, status_forcelist=[429, 502, 503, 504]
+        ),
+    ),
+)
+# Maps URL -> last 200 response; used to revalidate with If-None-Match
+_ETAG_CACHE = {}
+
+
+@functools.cache
+def _split_version(path):
     filename = os.path.basename(path)
     assert filename.endswith(".ebuild")
 
-    base_name = filename.rsplit(".ebuild", 1)[0]
-    match = _VERSION_REGEX.search(base_name)
-    if not match:
-        raise ValueError(f"Could not find a valid version in '{filename}'.")
+    # The version starts after the first '-' that is followed by a digit
+    base_name = filename[: -len(".ebuild")]
+    i = 0
+    while (i := base_name.find("-", i) + 1) > 0:
+        if base_name[i : i + 1].isdigit():
+            version, _, revision = base_name[i:].partition("-r")
+            return version, int(revision) if revision.isdigit() else 0
+
+    raise ValueError(f"Could not find a valid version in '{filename}'.")
 
-    return match.group(0)[1:]
+
+def extract_version(path):
+    # Upstream version without the ebuild revision
+    return _split_version(path)[0]
 
 
+@functools.cache
 def version_key(path):
-    revision = 0
-    version = version_full = extract_version(path)
-    if "-r" in version:
-        parts = version_full.rsplit("-r", 1)
-        version = parts[0]
-        revision = int(parts[1])
-    return [int(part) for part in version.split(".")] + [revision]
+    version, revision = _split_version(path)
+    return (*(int(part) for part in version.split(".")), revision)
 
 
 def make_name_from_channel(channel, base_name="brave-browser"):
@@ -59,6 +92,21 @@ def make_name_from_channel(channel, base_name="brave-browser"):
     return name
 
 
+@functools.lru_cache(maxsize=64)
+def list_ebuilds(ebuild_dir):
+    try:
+        with os.scandir(ebuild_dir) as it:
+            names = [e.name for e in it if e.is_file() and e.name.endswith(".ebuild")]
+    except FileNotFoundError:
+        return ()
+    names.sort(key=version_key)
+    return tuple(names)
+
+
+def invalidate_ebuilds():
+    list_ebuilds.cache_clear()
+
+
 def get_ebuilds(
     channel,
     base_name="brave-browser",
@@ -69,11 +117,11 @@ def get_ebuilds(
     repo_dir = repo_dir or os.getcwd()
 
     name = make_name_from_channel(channel, base_name=base_name)
-    ebuild_dir = os.path.join(repo_dir, f"www-client/{name}")
-    ebuilds = sorted(glob.glob(os.path.join(ebuild_dir, "*.ebuild")), key=version_key)
-
+    ebuild_dir = f"{repo_dir}/www-client/{name}"
+    filenames = list_ebuilds(ebuild_dir)
     if only_latest:
-        ebuilds = [ebuilds[-1]]
+        filenames = filenames[-1:]
+    ebuilds = [f"{ebuild_dir}/{filename}" for filename in filenames]
 
     if relative_paths:
         ebuilds = [os.path.relpath(ebuild, repo_dir) for ebuild in ebuilds]
@@ -81,17 +129,31 @@ def get_ebuilds(
     return ebuilds, ebuild_dir
 
 
-def gh_get(url, auth=False, **kwargs):
-    headers = {"Accept": "application/vnd.github.v3+json"}
+def gh_get(url, auth=False, session=SESSION, etag=None, **kwargs):
+    headers = {
+        "Accept": "application/vnd.github.v3+json",
+        "X-GitHub-Api-Version": "2022-11-28",
+    }
     if auth:
         token = os.environ.get("GITHUB_TOKEN")
         if not token:
             raise RuntimeError("GITHUB_TOKEN environment variable unset or empty.")
         headers["Authorization"] = f"token {token}"
 
-    response = requests.get(url, headers=headers, **kwargs)
+    cached = _ETAG_CACHE.get(url)
+    if etag is not None:
+        headers["If-None-Match"] = etag
+    elif cached is not None:
+        headers["If-None-Match"] = cached.headers["ETag"]
+
+    response = session.get(url, headers=headers, **kwargs)
     response.raise_for_status()
 
+    if response.status_code == 304 and cached is not None:
+        return cached
+    if response.status_code == 200 and "ETag" in response.headers:
+        _ETAG_CACHE[url] = response
+
     return response
 
 
@@ -121,8 +183,14 @@ def get_run_jobs(run_id):
     if not repo:
         raise RuntimeError("GITHUB_REPOSITORY environment variable unset or empty.")
 
-    response = gh_get(GH_API_ACTION_JOBS.format(repo=repo, run_id=run_id), auth=True)
-    return response.json()["jobs"]
+    jobs = []
+    url = GH_API_ACTION_JOBS.format(repo=repo, run_id=run_id) + "?per_page=100"
+    while url:
+        response = gh_get(url, auth=True)
+        jobs.extend(json_loads(response.content)["jobs"])
+        url = response.links.get("next", {}).get("url")
+
+    return jobs
 
 
 def set_output(name, value):
@@ -189,6 +257,8 @@ def collect_test_results(from_event=False, read_variables=False, write_variables
             continue
         job_name = job.get("name", "")
         assert "${{" not in job_name
+        if not job_name.startswith(_JOB_NAME_PREFIX):
+            continue
         match = _JOB_NAME_RE.match(job_name)
         if match:
             ebuild_path, channel = match.groups()
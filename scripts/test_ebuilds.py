@@ -8,67 +8,90 @@ import json
 import os
 import subprocess
 
+try:
+    import pygit2
+except ImportError:
+    pygit2 = None
+
 from shared import (
     CHANNELS,
     collect_test_results,
     extract_version,
-    get_ebuilds,
+    json_dumps,
     make_name_from_channel,
     require_gha,
     set_output,
     version_key,
 )
 
+_CHANNEL_BY_EBUILD_DIR = {
+    f"www-client/{make_name_from_channel(channel)}": channel for channel in CHANNELS
+}
+
+
+def get_added_files(commits, prefix):
+    if pygit2 is not None:
+        repo = pygit2.Repository(".")
+        a, b = [repo.revparse_single(commit).peel(pygit2.Commit) for commit in commits]
+        return [
+            delta.new_file.path
+            for delta in repo.diff(a, b).deltas
+            if delta.status == pygit2.GIT_DELTA_ADDED
+            and delta.new_file.path.startswith(prefix)
+        ]
+
+    result = subprocess.run(
+        [
+            "git",
+            "diff-tree",
+            "--diff-filter=A",
+            "--no-commit-id",
+            "--name-only",
+            "-r",
+            *commits,
+            "--",
+            f":/{prefix}",
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return result.stdout.splitlines()
+
 
 def build_test_matrix(mode, commits=None):
     matrix = []
     if mode == "latest-ebuilds":
         for channel in CHANNELS:
-            ebuilds, _ = get_ebuilds(channel, only_latest=True, relative_paths=True)
+            ebuild_dir = f"www-client/{make_name_from_channel(channel)}"
+            with os.scandir(ebuild_dir) as it:
+                ebuilds = [e.path for e in it if e.name.endswith(".ebuild")]
             if len(ebuilds) == 0:
                 raise RuntimeError(f"No ebuilds found for channel '{channel}'.")
 
-            latest_version = extract_version(ebuilds[0])
+            latest_ebuild = max(ebuilds, key=version_key)
             matrix.append(
                 {
                     "channel": channel,
-                    "version": latest_version,
-                    "ebuild_path": ebuilds[0],
+                    "version": extract_version(latest_ebuild),
+                    "ebuild_path": latest_ebuild,
                 }
             )
     elif mode == "new-ebuilds":
         assert len(commits) == 2
-        result = subprocess.run(
-            [
-                "git",
-                "diff-tree",
-                "--diff-filter=A",
-                "--no-commit-id",
-                "--name-only",
-                "-r",
-                *commits,
-                "--",
-                "www-client/",
-            ],
-            capture_output=True,
-            text=True,
-            check=True,
-        )
         new_ebuilds = [
-            ebuild
-            for ebuild in result.stdout.splitlines()
-            if ebuild.endswith(".ebuild")
+            path
+            for path in get_added_files(commits, "www-client/")
+            if path.endswith(".ebuild")
         ]
-        new_ebuilds.sort(
-            key=lambda ebuild: [os.path.dirname(ebuild)] + version_key(ebuild)
-        )
-        name_to_channel = {
-            f"www-client/{make_name_from_channel(channel)}": channel
-            for channel in CHANNELS
-        }
+        decorated = [
+            (ebuild.rpartition("/")[0], version_key(ebuild), ebuild)
+            for ebuild in new_ebuilds
+        ]
+        decorated.sort()
 
-        for ebuild in new_ebuilds:
-            channel = name_to_channel[os.path.dirname(ebuild)]
+        for ebuild_dir, _, ebuild in decorated:
+            channel = _CHANNEL_BY_EBUILD_DIR[ebuild_dir]
             entry = matrix.append(
                 {
                     "channel": channel,
@@ -137,7 +160,7 @@ def main():
     if args.build_test_matrix:
         mode = "new-ebuilds" if args.new_ebuilds else "latest-ebuilds"
         test_matrix = build_test_matrix(mode, commits=args.new_ebuilds or None)
-        set_output("test_matrix", json.dumps(test_matrix))
+        set_output("test_matrix", json_dumps(test_matrix))
         if args.verbose:
             print(json.dumps(test_matrix, indent=2))
 
@@ -147,7 +170,7 @@ def main():
             read_variables=args.read_variables,
             write_variables=args.write_variables,
         )
-        set_output("test_results", json.dumps(test_results))
+        set_output("test_results", json_dumps(test_results))
         if args.verbose:
             print(json.dumps(test_results, indent=2))
 
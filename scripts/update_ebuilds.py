@@ -4,68 +4,150 @@
 # SPDX-License-Identifier: MIT
 
 import argparse
-import glob
 import hashlib
 import json
+import mmap
 import os
+import queue
 import shutil
 import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
 from shared import (
     CHANNELS,
     CHANNELS_WITH_TITLE,
+    SESSION,
     collect_test_results,
     extract_version,
     get_ebuilds,
     gh_get,
+    invalidate_ebuilds,
+    json_loads,
+    list_ebuilds,
     make_name_from_channel,
     require_gha,
 )
 
 BRAVE_RELEASES = "https://api.github.com/repos/brave/brave-browser/releases"
+CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+    "update_ebuilds",
+)
+BRAVE_RELEASES_CACHE = os.path.join(CACHE_DIR, "releases.json")
+DIST_HASHES_CACHE = os.path.join(CACHE_DIR, "dist_hashes.json")
+DIST_HASHES_LOCK = threading.Lock()
 BRAVE_SOURCE_FILE = "{name}_{version}_amd64.deb"
 BRAVE_SOURCE_URL = f"https://github.com/brave/brave-browser/releases/download/v{{version}}/{BRAVE_SOURCE_FILE}"
 EBUILD_FILE = "{name}-{version}.ebuild"
 EBUILD_FILE_PATH = f"www-client/{{name}}/{EBUILD_FILE}"
-MANIFEST_HASH_ALGOS = ("BLAKE2B", "SHA512")
+DISTDIR = "/var/cache/distfiles"
+DOWNLOAD_CONNECTIONS = 4
+DOWNLOAD_MIN_RANGE_SIZE = 8 << 20
+LAYOUT_CONF = os.path.join(os.path.dirname(__file__), "..", "metadata", "layout.conf")
+DEFAULT_MANIFEST_HASH_ALGOS = ("BLAKE2B", "SHA512")  # Portage defaults
+
+
+def get_manifest_hash_algos(layout_conf=LAYOUT_CONF):
+    try:
+        with open(layout_conf, "r") as f:
+            for line in f:
+                key, sep, value = line.partition("=")
+                if sep and key.strip() == "manifest-hashes":
+                    return tuple(sorted(value.split()))
+    except FileNotFoundError:
+        pass
+
+    return DEFAULT_MANIFEST_HASH_ALGOS
+
+
+MANIFEST_HASH_ALGOS = get_manifest_hash_algos()
+MANIFEST_DIST_LINE = (
+    "DIST {file} {size} "
+    + " ".join(f"{algo} {{{algo}}}" for algo in MANIFEST_HASH_ALGOS)
+    + "\n"
+)
+
+
+def load_releases_cache():
+    try:
+        with open(BRAVE_RELEASES_CACHE, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_releases_cache(etag, releases, next_url):
+    # Only keep the fields get_latest_releases() looks at
+    cache = {
+        "etag": etag,
+        "releases": [
+            {
+                "name": release["name"],
+                "tag_name": release["tag_name"],
+                "assets": [{"name": asset["name"]} for asset in release["assets"]],
+            }
+            for release in releases
+        ],
+        "next": next_url,
+    }
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(BRAVE_RELEASES_CACHE, "w") as f:
+        json.dump(cache, f)
+
+
+def get_releases_page(url, cache=None):
+    if cache is None:
+        response = gh_get(url)
+        return json_loads(response.content), response.links.get("next", {}).get("url")
+
+    response = gh_get(url, etag=cache.get("etag"))
+    if response.status_code == 304:
+        return cache["releases"], cache["next"]
+
+    page_releases = json_loads(response.content)
+    next_url = response.links.get("next", {}).get("url")
+    if etag := response.headers.get("ETag"):
+        save_releases_cache(etag, page_releases, next_url)
+    return page_releases, next_url
 
 
 def get_latest_releases():
     releases = {channel: None for channel, _ in CHANNELS_WITH_TITLE}
-    releases_found = 0
+    pending = list(CHANNELS_WITH_TITLE)
     page = 0
     MAX_PAGES = 5
-    url = BRAVE_RELEASES
+    url = f"{BRAVE_RELEASES}?per_page=100"
     while url and page < MAX_PAGES:
-        response = gh_get(url)
-        for release in response.json():
-            for channel, title in CHANNELS_WITH_TITLE:
-                if not releases[channel] and release["name"].startswith(title):
-                    tag = release["tag_name"]
-                    assert tag[0] == "v"
-                    version = tag[1:]
-
-                    name = make_name_from_channel(channel)
-                    source_file = BRAVE_SOURCE_FILE.format(name=name, version=version)
-                    asset_files = {asset["name"] for asset in release["assets"]}
-                    if source_file in asset_files:
-                        releases[channel] = tag[1:]
-                        releases_found += 1
-
-            if releases_found == len(releases):
-                break
-
-        if releases_found == len(releases):
-            break
-
-        url = response.links.get("next", {}).get("url")
-        page += 1
+        # Revalidate the first page against the on-disk cache
+        page_releases, next_url = get_releases_page(
+            url, cache=load_releases_cache() if page == 0 else None
+        )
+        for release in page_releases:
+            for channel, title in pending:
+                if not release["name"].startswith(title):
+                    continue
 
-    if not releases_found == len(releases):
-        raise RuntimeError("Could not find latest release for all channels.")
+                tag = release["tag_name"]
+                assert tag[0] == "v"
+                version = tag[1:]
 
-    return releases
+                name = make_name_from_channel(channel)
+                source_file = BRAVE_SOURCE_FILE.format(name=name, version=version)
+                if any(asset["name"] == source_file for asset in release["assets"]):
+                    releases[channel] = version
+                    pending.remove((channel, title))
+                break  # Titles are distinct prefixes
+
+            if not pending:
+                return releases
+
+        url = next_url
+        page += 1
+
+    raise RuntimeError("Could not find latest release for all channels.")
 
 
 def get_new_releases(releases, repo_dir=None):
@@ -79,78 +161,245 @@ def get_new_releases(releases, repo_dir=None):
     return new_releases
 
 
+def multi_file_digest(f, algos):
+    hashers = {algo: hashlib.new(algo.lower()) for algo in algos}
+    size = os.fstat(f.fileno()).st_size
+    if size > 0:
+        # Hash the same mapping with every algorithm concurrently; hashlib
+        # releases the GIL while updating large buffers.
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            with memoryview(mm) as mv, ThreadPoolExecutor(len(hashers)) as executor:
+                futures = [
+                    executor.submit(hasher.update, mv) for hasher in hashers.values()
+                ]
+                for future in futures:
+                    future.result()
+
+    return size, {algo: hasher.hexdigest() for algo, hasher in hashers.items()}
+
+
+def load_dist_hashes():
+    try:
+        with open(DIST_HASHES_CACHE, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def get_cached_digests(filename, size):
+    digests = load_dist_hashes().get(f"{filename} {size}", {})
+    if all(algo in digests for algo in MANIFEST_HASH_ALGOS):
+        return {algo: digests[algo] for algo in MANIFEST_HASH_ALGOS}
+    return None
+
+
+def cache_digests(filename, size, digests):
+    # Sources are hashed concurrently; serialize the read-modify-write
+    with DIST_HASHES_LOCK:
+        cache = load_dist_hashes()
+        cache[f"{filename} {size}"] = digests
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(DIST_HASHES_CACHE, "w") as f:
+            json.dump(cache, f)
+
+
+def stream_digest(stream, algos):
+    hashers = {algo: hashlib.new(algo.lower()) for algo in algos}
+    size = 0
+
+    # Hash on a separate thread so reading from the socket is not stalled
+    chunks = queue.Queue(maxsize=4)
+
+    def consume():
+        while (chunk := chunks.get()) is not None:
+            for hasher in hashers.values():
+                hasher.update(chunk)
+
+    consumer = threading.Thread(target=consume)
+    consumer.start()
+    try:
+        while chunk := stream.read(1 << 20):
+            size += len(chunk)
+            chunks.put(chunk)
+    finally:
+        chunks.put(None)
+        consumer.join()
+
+    return size, {algo: hasher.hexdigest() for algo, hasher in hashers.items()}
+
+
+def download_ranges(head, f):
+    url = head.url
+    size = int(head.headers.get("Content-Length", 0))
+
+    if head.headers.get("Accept-Ranges") != "bytes" or size < DOWNLOAD_MIN_RANGE_SIZE:
+        return False
+
+    # Fetch byte ranges of the redirect target in parallel
+    f.truncate(size)
+    range_size = -(-size // DOWNLOAD_CONNECTIONS)
+
+    def fetch_range(start):
+        end = min(start + range_size, size) - 1
+        offset = start
+        with SESSION.get(
+            url,
+            headers={"Range": f"bytes={start}-{end}"},
+            stream=True,
+            timeout=300,
+        ) as r:
+            r.raise_for_status()
+            if r.status_code != 206:
+                raise RuntimeError(f"Range request not honored for '{url}'.")
+            r.raw.decode_content = True
+            while chunk := r.raw.read(1 << 20):
+                offset += os.pwrite(f.fileno(), chunk, offset)
+        if offset != end + 1:
+            raise RuntimeError(f"Short read for bytes {start}-{end} of '{url}'.")
+
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_CONNECTIONS) as executor:
+        for _ in executor.map(fetch_range, range(0, size, range_size)):
+            pass
+
+    return True
+
+
+def fetch_and_hash(source):
+    # Reuse a copy already fetched by Portage
+    distfile = os.path.join(os.environ.get("DISTDIR", DISTDIR), source["file"])
+    try:
+        with open(distfile, "rb") as f:
+            if os.fstat(f.fileno()).st_size:
+                return multi_file_digest(f, MANIFEST_HASH_ALGOS)
+    except OSError:
+        pass
+
+    # Without a usable HEAD response, fall back to a plain streamed GET
+    try:
+        head = SESSION.head(source["url"], allow_redirects=True, timeout=60)
+        head.raise_for_status()
+    except requests.RequestException:
+        head = None
+
+    size = int(head.headers.get("Content-Length", 0)) if head is not None else 0
+    if size and (digests := get_cached_digests(source["file"], size)):
+        return size, digests
+
+    digests = None
+    if head is not None:
+        with tempfile.TemporaryFile() as tmp:
+            if download_ranges(head, tmp):
+                size, digests = multi_file_digest(tmp, MANIFEST_HASH_ALGOS)
+
+    if digests is None:
+        with SESSION.get(source["url"], stream=True, timeout=300) as r:
+            r.raise_for_status()
+            r.raw.decode_content = True
+            size, digests = stream_digest(r.raw, MANIFEST_HASH_ALGOS)
+
+    cache_digests(source["file"], size, digests)
+    return size, digests
+
+
 def update_manifest(ebuild_dir, name):
-    ebuilds = glob.glob(os.path.join(ebuild_dir, "*.ebuild"))
-    versions = set(extract_version(ebuild) for ebuild in ebuilds)
-    versions_in_manifest = set()
-    sources = [
-        {
+    sources_by_filename = {}
+    for ebuild in list_ebuilds(ebuild_dir):
+        version = extract_version(ebuild)
+        source = {
             "file": BRAVE_SOURCE_FILE.format(name=name, version=version),
             "url": BRAVE_SOURCE_URL.format(name=name, version=version),
             "version": version,
         }
-        for version in versions
-    ]
-    sources_by_filename = {source["file"]: source for source in sources}
-    sources_by_version = {source["version"]: source for source in sources}
-    with open(os.path.join(ebuild_dir, "Manifest"), "r") as f:
-        lines = f.readlines()
-        new_lines = []
-        for line in lines:
-            parts = line.split(" ")
-            if parts[0] == "DIST":
-                if parts[1] in sources_by_filename:
+        sources_by_filename[source["file"]] = source
+
+    files_in_manifest = set()
+    new_lines = []
+    with open(os.path.join(ebuild_dir, "Manifest"), "rb") as f:
+        for line in f.read().splitlines(keepends=True):
+            if line.startswith(b"DIST "):
+                filename = line.split(b" ", 2)[1].decode()
+                if filename in sources_by_filename:
                     # Keep DIST lines for current ebuilds
                     new_lines.append(line)
-                    versions_in_manifest.add(sources_by_filename[parts[1]]["version"])
+                    files_in_manifest.add(filename)
             else:
                 new_lines.append(line)
 
     # Add DIST lines for new ebuilds
-    for version in versions - versions_in_manifest:
-        source = sources_by_version[version]
-        hashers = {algo: hashlib.new(algo.lower()) for algo in MANIFEST_HASH_ALGOS}
-        size = 0
-        with requests.get(source["url"], stream=True, timeout=300) as r:
-            r.raise_for_status()
-            for chunk in r.iter_content(chunk_size=8192):
-                size += len(chunk)
-                for hasher in hashers.values():
-                    hasher.update(chunk)
-
-        digests = {algo: hasher.hexdigest() for algo, hasher in hashers.items()}
-        new_lines.append(
-            f"DIST {source['file']} {size} {' '.join([f'{algo} {digest}' for algo, digest in digests.items()])}\n"
-        )
+    new_sources = [
+        source
+        for filename, source in sources_by_filename.items()
+        if filename not in files_in_manifest
+    ]
+    if new_sources:
+        with ThreadPoolExecutor(max_workers=min(4, len(new_sources))) as executor:
+            for source, (size, digests) in zip(
+                new_sources, executor.map(fetch_and_hash, new_sources)
+            ):
+                new_lines.append(
+                    MANIFEST_DIST_LINE.format(
+                        file=source["file"], size=size, **digests
+                    ).encode()
+                )
 
-    with open(os.path.join(ebuild_dir, "Manifest"), "w") as f:
-        f.writelines(new_lines)
+    with open(os.path.join(ebuild_dir, "Manifest"), "wb") as f:
+        f.write(b"".join(new_lines))
+
+
+def add_ebuild_for_new_release(channel, version, repo_dir):
+    ebuilds, ebuild_dir = get_ebuilds(channel, repo_dir=repo_dir, only_latest=True)
+    if len(ebuilds) == 0:
+        raise RuntimeError(f"No ebuilds for release channel '{channel}'.")
+    latest_ebuild = ebuilds[0]
+    name = make_name_from_channel(channel)
+    filename = EBUILD_FILE.format(name=name, version=version)
+    new_ebuild = os.path.join(ebuild_dir, filename)
+
+    # Hard links are only used on throwaway CI checkouts. Locally the latest
+    # ebuild may be edited by hand, and editors that save in place would
+    # silently change the previous ebuild through a shared inode.
+    linked = False
+    if "GITHUB_ACTIONS" in os.environ:
+        try:
+            os.link(latest_ebuild, new_ebuild)
+            linked = True
+        except OSError:
+            pass
+    if not linked:
+        shutil.copy(latest_ebuild, new_ebuild)
+    invalidate_ebuilds()
+    update_manifest(ebuild_dir, name)
+
+    return (
+        [new_ebuild, os.path.join(ebuild_dir, "Manifest")],
+        f"www-client/{name}: added {version}",
+    )
 
 
 def add_ebuilds_for_new_releases(new_releases, repo_dir, commit_changes=False):
     new_ebuilds = dict()
-    for channel, version in new_releases.items():
-        ebuilds, ebuild_dir = get_ebuilds(channel, repo_dir=repo_dir, only_latest=True)
-        if len(ebuilds) == 0:
-            raise RuntimeError(f"No ebuilds for release channel '{channel}'.")
-        latest_ebuild = ebuilds[0]
-        name = make_name_from_channel(channel)
-        filename = EBUILD_FILE.format(name=name, version=version)
-        new_ebuild = os.path.join(ebuild_dir, filename)
-
-        shutil.copy(latest_ebuild, new_ebuild)
-        update_manifest(ebuild_dir, name)
-        new_ebuilds.setdefault(channel, []).append(version)
-
-        if commit_changes:
-            subprocess.run(
-                ["git", "add", new_ebuild, os.path.join(ebuild_dir, "Manifest")],
-                check=True,
-            )
-            subprocess.run(
-                ["git", "commit", "-m", f"www-client/{name}: added {version}"],
-                check=True,
-            )
+    commits = []
+    if new_releases:
+        # Channels are independent; git operations stay serialized below
+        with ThreadPoolExecutor(max_workers=len(new_releases)) as executor:
+            futures = {
+                channel: executor.submit(
+                    add_ebuild_for_new_release, channel, version, repo_dir
+                )
+                for channel, version in new_releases.items()
+            }
+            for channel, future in futures.items():
+                commits.append(future.result())
+                new_ebuilds.setdefault(channel, []).append(new_releases[channel])
+
+    if commit_changes and commits:
+        # Stage everything at once, then commit each channel's paths separately
+        subprocess.run(
+            ["git", "add", "--", *(path for paths, _ in commits for path in paths)],
+            check=True,
+        )
+        for paths, message in commits:
+            subprocess.run(["git", "commit", "-m", message, "--", *paths], check=True)
 
     return new_ebuilds
 
@@ -187,26 +436,25 @@ def prune_ebuilds(repo_dir=None, commit_changes=False, successful_channels_only=
             dropped = []
             name = make_name_from_channel(channel)
             for ebuild in ebuilds[:-1]:
-                if commit_changes:
-                    subprocess.run(["git", "rm", ebuild], check=True)
-                else:
-                    os.unlink(ebuild)
+                os.unlink(ebuild)
                 version = extract_version(ebuild)
                 dropped.append(version)
                 pruned_ebuilds.setdefault(channel, []).append(version)
 
+            invalidate_ebuilds()
             update_manifest(ebuild_dir, name)
 
             if commit_changes:
-                subprocess.run(
-                    ["git", "add", os.path.join(ebuild_dir, "Manifest")], check=True
-                )
+                # Committing the paths stages the deletions and the Manifest
                 subprocess.run(
                     [
                         "git",
                         "commit",
                         "-m",
                         f"www-client/{name}: dropped {', '.join(dropped)}",
+                        "--",
+                        *ebuilds[:-1],
+                        os.path.join(ebuild_dir, "Manifest"),
                     ],
                     check=True,
                 )